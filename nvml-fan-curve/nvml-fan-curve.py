@@ -15,6 +15,15 @@ import os
 import time
 import argparse
 import signal
+import math
+import socket
+import stat
+import threading
+import json
+import bisect
+import random
+import builtins
+import cProfile
 
 try:
     from pynvml import *
@@ -81,31 +90,75 @@ def compare_versions(version1, version2):
 
     return True
 
+def import_numpy():
+    # Imported only when requested, it is not needed for the main loop and would only slow down startup
+    try:
+        import numpy
+        return numpy
+    except ModuleNotFoundError:
+        return None
+
 def create_interrupt_handler(variable):
     def interrupt_handler(sig, frame):
         variable['running'] = False
     return interrupt_handler
 
-def validate_args(args):
-    if args.curve:
-        pairs = args.curve.split(',')
-        invalid = False
-        if len(pairs) < 1:
-            invalid = True
-        for pair in pairs:
-            if ':' not in pair:
-                invalid = True
-    else:
-        invalid = True
+def validate_curve(curve):
+    if not curve:
+        return False
+
+    pairs = curve.split(',')
+    if len(pairs) < 1:
+        return False
+    for pair in pairs:
+        if ':' not in pair:
+            return False
 
-    if invalid:
+    return True
+
+def validate_args(args):
+    if not validate_curve(args.curve):
         print("Error: Curve must contain at least one point in the format 'temperature:speed,...'", file=sys.stderr)
         exit(1)
 
+    if args.hysteresis < 0:
+        print("Error: Hysteresis must not be negative", file=sys.stderr)
+        exit(1)
+
+    try:
+        args.filter = parse_filters(args.filter)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not args.filter_size > 0:
+        print("Error: Filter size must be bigger than 0", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not 0 < args.filter_alpha <= 1:
+        print("Error: Filter alpha must be in range 0 - 1", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not args.filter_slew > 0:
+        print("Error: Filter slew must be bigger than 0", file=sys.stderr)
+        exit(1)
+
+    if args.filter and args.filter_deadband < 0:
+        print("Error: Filter deadband must not be negative", file=sys.stderr)
+        exit(1)
+
     if not args.sleep > 0:
         print("Error: Sleep time must be bigger than 0", file=sys.stderr)
         exit(1)
 
+    if args.profile < 0:
+        print("Error: Profile interval must not be negative", file=sys.stderr)
+        exit(1)
+
+    if args.profile_dump and not args.profile > 0:
+        print("Error: Profile dump requires profile interval to be set", file=sys.stderr)
+        exit(1)
+
 def parse_fan_curve(fan_curve):
     speed_curve = {}
     temp_points = []
@@ -121,6 +174,36 @@ def parse_fan_curve(fan_curve):
     temp_points.sort()
     return speed_curve, temp_points
 
+def compile_fan_curve(fan_curve):
+    if not validate_curve(fan_curve):
+        raise ValueError("Curve must contain at least one point in the format 'temperature:speed,...'")
+
+    speed_curve, temp_points = parse_fan_curve(fan_curve)
+    min_temp = temp_points[0]
+    min_speed = speed_curve[min_temp]
+
+    # Precompute target speed bands for every whole degree in a realistic range so the main loop only does a lookup
+    low_temp = max(-20, min(0, min_temp))
+    high_temp = min(150, max(0, temp_points[-1]))
+    speeds = interpolate_speeds(range(low_temp, high_temp + 1), speed_curve, temp_points, min_temp, min_speed)
+
+    return fan_curve, speed_curve, temp_points, min_temp, min_speed, compile_bands(speeds, low_temp)
+
+def compile_settings(values, current):
+    settings = dict(current)
+
+    for key, value in values.items():
+        if key == 'curve':
+            settings['curve'] = compile_fan_curve(value)
+        elif key == 'hysteresis':
+            settings['hysteresis'] = int(value)
+            if settings['hysteresis'] < 0:
+                raise ValueError("Hysteresis must not be negative")
+        else:
+            raise ValueError(f"Unknown setting '{key}'")
+
+    return settings
+
 def interpolate_speed(temp, speed_curve, temp_points, min_temp, min_speed):
     if temp < min_temp:
         return min_speed
@@ -139,6 +222,340 @@ def interpolate_speed(temp, speed_curve, temp_points, min_temp, min_speed):
 
     return speed_curve[temp_points[-1]]
 
+def interpolate_speeds(temps, speed_curve, temp_points, min_temp, min_speed, use_numpy = False):
+    # Same as interpolate_speed() but for many temperatures (devices) at once
+    np = import_numpy() if use_numpy else None
+    if np is None:
+        speeds = []
+        last = len(temp_points)
+
+        for temp in temps:
+            if temp < min_temp:
+                speeds.append(min_speed)
+                continue
+
+            i = bisect.bisect_right(temp_points, temp)
+            if i < last:
+                prev_temp = temp_points[i - 1]
+                prev_speed = speed_curve[prev_temp]
+                delta_speed = speed_curve[temp_points[i]] - prev_speed
+                speeds.append(prev_speed + ((temp - prev_temp) * delta_speed // (temp_points[i] - prev_temp)))
+            else:
+                speeds.append(speed_curve[temp_points[-1]])
+
+        return speeds
+
+    points = np.asarray(temp_points, dtype=np.int64)
+    values = np.asarray([speed_curve[temp] for temp in temp_points], dtype=np.int64)
+    temps = np.asarray(temps, dtype=np.int64)
+
+    i = np.clip(np.searchsorted(points, temps, side='right'), 1, len(points) - 1)
+    prev_temp = points[i - 1]
+    delta_temp = np.maximum(points[i] - prev_temp, 1)
+    speeds = values[i - 1] + np.floor_divide((temps - prev_temp) * (values[i] - values[i - 1]), delta_temp)
+
+    speeds = np.where(temps >= points[-1], values[-1], speeds)
+    speeds = np.where(temps < min_temp, min_speed, speeds)
+
+    return speeds.tolist()
+
+def compile_bands(values, first):
+    # Group a lookup table into bands of equal values, so leaving a band is what counts as crossing a threshold
+    bands = [None] * len(values)
+    start = 0
+
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            low = first + start if start > 0 else -math.inf
+            high = first + i - 1 if i < len(values) else math.inf
+            band = (values[start], low, high)
+
+            for j in range(start, i):
+                bands[j] = band
+            start = i
+
+    return first, bands
+
+def lookup_band(value, table):
+    first, bands = table
+    index = value - first
+
+    if index < 0:
+        return bands[0]
+    if index >= len(bands):
+        return bands[-1]
+
+    return bands[index]
+
+def update_band(value, band, table, deadband_down = 0, deadband_up = 0):
+    # Keep the current band until the value leaves it by more than the deadband
+    if band is not None and band[1] - deadband_down <= value <= band[2] + deadband_up:
+        return band
+
+    return lookup_band(value, table)
+
+def apply_hysteresis(temp, control_temp, hysteresis):
+    if hysteresis > 0 and temp > 50:  # Hysteresis at 50 and below doesn't make any sense
+        if temp > control_temp or temp <= control_temp - hysteresis:
+            return temp
+        return control_temp
+
+    return temp
+
+def parse_filters(value):
+    if not value or value.lower() == 'none':
+        return []
+
+    filters = [name.strip().lower() for name in value.split(',')]
+    for name in filters:
+        if name not in ['ema', 'median', 'slew']:
+            raise ValueError(f"Invalid filter '{name}', must be one of: ema, median, slew")
+
+    return filters
+
+def create_sensor_filter(filters, size, alpha, slew, limit_rise = True):
+    return {
+        'filters': filters,
+        'limit_rise': limit_rise,
+        'size': size,
+        'alpha': alpha,
+        'slew': slew,
+        'buffer': [0] * size,
+        'sorted': [0] * size,
+        'index': 0,
+        'count': 0,
+        'ema': None,
+        'value': None,
+    }
+
+def apply_sensor_filter(sensor, value):
+    for name in sensor['filters']:
+        if name == 'median':
+            buffer = sensor['buffer']
+            buffer[sensor['index']] = value
+            sensor['index'] = (sensor['index'] + 1) % sensor['size']
+
+            if sensor['count'] < sensor['size']:
+                sensor['count'] += 1
+                value = sorted(buffer[:sensor['count']])[sensor['count'] // 2]
+            else:
+                ordered = sensor['sorted']
+                ordered[:] = buffer
+                ordered.sort()
+                value = ordered[sensor['size'] // 2]
+
+        elif name == 'ema':
+            if sensor['ema'] is not None:
+                value = sensor['ema'] + sensor['alpha'] * (value - sensor['ema'])
+            sensor['ema'] = value
+
+        elif name == 'slew':
+            last = sensor['value']
+            if last is not None:
+                value = max(value, last - sensor['slew'])
+                if sensor['limit_rise']:
+                    value = min(value, last + sensor['slew'])
+            sensor['value'] = value
+
+    return value
+
+def round_half_up(value):
+    # round() rounds halves to even which would keep alternating readings alternating
+    return math.floor(value + 0.5)
+
+def read_replay(file_path):
+    values = []
+    skipped = 0
+
+    try:
+        with open(file_path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    try:
+                        values.append(int(float(line.split(',')[0])))
+                    except ValueError:  # Header or other non-numeric line
+                        skipped += 1
+    except OSError as error:
+        print(f"Error: Unable to read '{file_path}': {error}", file=sys.stderr)
+        exit(1)
+
+    if skipped > 0:
+        print(f"Warning: Skipped {skipped} non-numeric lines in '{file_path}'", file=sys.stderr)
+
+    return values
+
+def estimate_delay(reference, delayed, max_lag = 30):
+    best_lag = 0
+    best_error = None
+
+    for lag in range(min(max_lag, len(reference) - 1) + 1):
+        error = sum(abs(delayed[i] - reference[i - lag]) for i in range(lag, len(reference))) / (len(reference) - lag)
+        if best_error is None or error < best_error:
+            best_lag = lag
+            best_error = error
+
+    return best_lag
+
+def run_replay(file_path, args, settings):
+    temps = read_replay(file_path)
+    if not temps:
+        print(f"Error: No samples found in '{file_path}'", file=sys.stderr)
+        exit(1)
+
+    speed_table = settings['curve'][5]
+    results = []
+
+    for sensor in [None, create_sensor_filter(args.filter, args.filter_size, args.filter_alpha, args.filter_slew, False)]:
+        deadband = args.filter_deadband if sensor else 0
+        control_temp = 0
+        band = None
+        target_fan_speed = None
+        writes = 0
+        control_temps = []
+
+        for temp in temps:
+            if sensor:
+                temp = round_half_up(apply_sensor_filter(sensor, temp))
+
+            control_temp = apply_hysteresis(temp, control_temp, settings['hysteresis'])
+            band = update_band(control_temp, band, speed_table, deadband)
+            speed = band[0]
+
+            if speed != target_fan_speed:
+                target_fan_speed = speed
+                writes += 1
+
+            control_temps.append(control_temp)
+
+        results.append((writes, control_temps))
+
+    (raw_writes, raw_temps), (filtered_writes, filtered_temps) = results
+    delay = estimate_delay(raw_temps, filtered_temps)
+    reduction = (1 - filtered_writes / raw_writes) * 100
+
+    print(f"Replayed {len(temps)} samples (filter = {','.join(args.filter) or 'none'}, sleep = {args.sleep})")
+    print(f"Fan speed writes: {raw_writes} unfiltered, {filtered_writes} filtered ({reduction:.1f}% fewer)")
+    print(f"Added reaction delay: {delay} ticks ({delay * args.sleep:.1f} s)")
+
+def create_profiler(interval, dump_path):
+    profiler = {
+        'interval': interval,
+        'dump_path': dump_path,
+        'cprofile': None,
+        'tick_start': None,
+        'ticks': 0,
+        'total': 0,
+        'phases': {},
+        'calls': {},
+    }
+
+    if dump_path:
+        profiler['cprofile'] = cProfile.Profile()
+
+    reset_profiler(profiler)
+    return profiler
+
+def reset_profiler(profiler):
+    profiler['ticks'] = 0
+    profiler['total'] = 0
+    profiler['phases'] = {'nvml_read': 0, 'nvml_write': 0, 'print': 0, 'sleep': 0, 'overshoot': 0}
+    profiler['calls'] = {}
+
+def create_profiled_call(profiler, name, function, phase):
+    def profiled_call(*arguments, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*arguments, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler['phases'][phase] += elapsed
+
+            call = profiler['calls'].get(name)
+            if call is None:
+                call = profiler['calls'][name] = [0, 0]
+            call[0] += 1
+            call[1] += elapsed
+
+    return profiled_call
+
+def wrap_profiled_calls(profiler):
+    module = globals()
+
+    for name, value in list(module.items()):
+        if name.startswith('nvml') and callable(value) and not isinstance(value, type):
+            phase = 'nvml_write' if 'Set' in name or 'Reset' in name else 'nvml_read'
+            module[name] = create_profiled_call(profiler, name, value, phase)
+
+    module['print'] = create_profiled_call(profiler, 'print', builtins.print, 'print')
+
+def profile_tick(profiler):
+    now = time.perf_counter()
+
+    if profiler['tick_start'] is None:  # First iteration, drop everything recorded during setup
+        reset_profiler(profiler)
+
+        if profiler['cprofile']:
+            profiler['cprofile'].enable()
+    else:
+        profiler['total'] += now - profiler['tick_start']
+        profiler['ticks'] += 1
+
+        if profiler['ticks'] >= profiler['interval']:
+            stop_profiler(profiler)
+            print_profile_summary(profiler)
+            reset_profiler(profiler)
+
+    profiler['tick_start'] = time.perf_counter()
+
+def profile_sleep(profiler, seconds):
+    start = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+
+    profiler['phases']['sleep'] += elapsed
+    profiler['phases']['overshoot'] += elapsed - seconds
+
+def stop_profiler(profiler):
+    cprofile = profiler['cprofile']
+    if not cprofile:
+        return
+
+    profiler['cprofile'] = None
+    cprofile.disable()
+
+    try:
+        cprofile.dump_stats(profiler['dump_path'])
+        builtins.print(f"Profile data written to {profiler['dump_path']} (view with: python3 -m pstats {profiler['dump_path']})")
+    except OSError as error:
+        builtins.print(f"Warning: Unable to write profile data to {profiler['dump_path']}: {error}", file=sys.stderr)
+
+def finish_profiler(profiler):
+    # Account the last iteration and report whatever was collected since the last summary
+    if profiler['tick_start'] is not None:
+        profiler['total'] += time.perf_counter() - profiler['tick_start']
+        profiler['ticks'] += 1
+        profiler['tick_start'] = None
+
+    stop_profiler(profiler)
+    print_profile_summary(profiler)
+
+def print_profile_summary(profiler):
+    ticks = profiler['ticks']
+    if ticks == 0:
+        return
+
+    phases = profiler['phases']
+    logic = profiler['total'] - phases['nvml_read'] - phases['nvml_write'] - phases['print'] - phases['sleep']
+
+    def ms(value):
+        return f"{value / ticks * 1000:.3f} ms"
+
+    builtins.print(f"Profile of {ticks} iterations (average per iteration): total = {ms(profiler['total'])}, nvml read = {ms(phases['nvml_read'])}, nvml write = {ms(phases['nvml_write'])}, logic = {ms(logic)}, print = {ms(phases['print'])}, sleep = {ms(phases['sleep'])} (overshoot = {ms(phases['overshoot'])})")
+
+    for name, (count, elapsed) in sorted(profiler['calls'].items(), key=lambda item: item[1][1], reverse=True):
+        builtins.print(f"  {name}: {count} calls, {elapsed / count * 1000000:.1f} us per call, {elapsed * 1000:.3f} ms total")
+
 def set_gpu_fan_policy(handle, fans = 1, manual = False):
     # Possibly this could be replaced (default policy)
     #for i in range(fans):
@@ -157,6 +574,160 @@ def set_gpu_fan_speed(handle, fans = 1, speed = 50):
     else:
         set_gpu_fan_policy(handle, fans, False)
 
+def parse_control_command(line):
+    parts = line.split()
+    if not parts:
+        raise ValueError("Empty command")
+
+    values = {}
+    for part in parts[1:]:
+        if '=' not in part:
+            raise ValueError(f"Invalid argument '{part}', expected 'key=value'")
+        key, value = part.split('=', 1)
+        values[key.lower().replace('-', '_')] = value
+
+    return parts[0].lower(), values
+
+def create_control_handler(control, compile_settings):
+    def control_handler(line):
+        command, values = parse_control_command(line)
+
+        if command == 'status':
+            status = dict(control['status'])
+            expires = control['expires']
+            status['override'] = max(0, round(expires - time.monotonic(), 1)) if expires is not None else None
+            return status
+
+        if command == 'set':
+            ttl = float(values.pop('ttl', 0))
+            if not math.isfinite(ttl) or ttl < 0:
+                raise ValueError("TTL must be a non-negative number")
+            if not values:
+                raise ValueError("Nothing to set")
+
+            with control['lock']:
+                if ttl > 0:
+                    control['settings'] = compile_settings(values, control['settings'])
+                    control['expires'] = time.monotonic() + ttl
+                else:
+                    control['base'] = compile_settings(values, control['base'])
+                    control['settings'] = compile_settings(values, control['settings'])
+                control['changed'] = True
+
+            return {'ok': True}
+
+        if command == 'reset':
+            with control['lock']:
+                control['settings'] = control['base']
+                control['expires'] = None
+                control['changed'] = True
+
+            return {'ok': True}
+
+        raise ValueError(f"Unknown command '{command}'")
+
+    return control_handler
+
+def create_control_socket(path, handler):
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Error: Control socket is not supported on this platform", file=sys.stderr)
+        exit(1)
+
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            print(f"Error: Control socket path '{path}' exists and is not a socket", file=sys.stderr)
+            exit(1)
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:  # Stale socket left behind by a previous run
+            os.unlink(path)
+        except OSError as error:
+            print(f"Error: Unable to check existing control socket '{path}': {error}", file=sys.stderr)
+            exit(1)
+        else:
+            print(f"Error: Another process is already listening on control socket '{path}'", file=sys.stderr)
+            exit(1)
+        finally:
+            probe.close()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # Socket must not be accessible by anyone else, not even briefly
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(4)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:  # Socket was closed
+                break
+
+            with connection:
+                try:
+                    connection.settimeout(1)
+                    line = connection.makefile('r').readline()
+                    response = handler(line.strip())
+                except Exception as error:
+                    response = {'error': str(error)}
+
+                try:
+                    connection.sendall((json.dumps(response) + '\n').encode())
+                except OSError:
+                    pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+def poll_control_settings(control):
+    if not control['changed'] and control['expires'] is None:
+        return None
+
+    with control['lock']:
+        if control['expires'] is not None and time.monotonic() >= control['expires']:
+            control['settings'] = control['base']
+            control['expires'] = None
+            control['changed'] = True
+
+        if not control['changed']:
+            return None
+
+        control['changed'] = False
+        return control['settings']
+
+def run_benchmark(max_devices, speed_curve, temp_points, min_temp, min_speed, iterations = 200):
+    methods = [('loop', lambda temps: [interpolate_speed(temp, speed_curve, temp_points, min_temp, min_speed) for temp in temps])]
+    methods.append(('batch', lambda temps: interpolate_speeds(temps, speed_curve, temp_points, min_temp, min_speed)))
+    if import_numpy() is not None:
+        methods.append(('numpy', lambda temps: interpolate_speeds(temps, speed_curve, temp_points, min_temp, min_speed, True)))
+    else:
+        print("Warning: Module 'numpy' not found, skipping numpy benchmark", file=sys.stderr)
+
+    print(f"{'devices':>8}" + ''.join(f"{name + ' (us)':>14}" for name, _ in methods))
+
+    devices = 1
+    while devices <= max_devices:
+        temps = [random.randint(min_temp - 10, temp_points[-1] + 10) for _ in range(devices)]
+        expected = methods[0][1](temps)
+        row = f"{devices:>8}"
+
+        for name, method in methods:
+            if method(temps) != expected:
+                print(f"Error: '{name}' results differ from reference", file=sys.stderr)
+                exit(1)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                method(temps)
+            row += f"{(time.perf_counter() - start) / iterations * 1000000:>14.1f}"
+
+        print(row)
+        devices *= 2
+
 def main():
     parser = argparse.ArgumentParser(
         description="Fan curve script using official NVML API",
@@ -170,6 +741,16 @@ def main():
     parser.add_argument('-c', '--curve', type=str, help='fan curve points, in format "temperature:speed,..."', default=None)
     parser.add_argument('-y', '--hysteresis', type=int, help='temperature hysteresis (down only)', default=0)
     parser.add_argument('-s', '--sleep', type=float, help='sleep time in main loop', default=1)
+    parser.add_argument('-o', '--socket', type=str, help='control socket path', default=None)
+    parser.add_argument('-f', '--filter', type=str, help='temperature filters to apply, in order (ema, median, slew)', default=None)
+    parser.add_argument('--filter-size', type=int, help='median filter window size', default=5)
+    parser.add_argument('--filter-alpha', type=float, help='EMA filter smoothing factor', default=0.5)
+    parser.add_argument('--filter-slew', type=float, help='slew filter maximum decrease per loop iteration (C)', default=1)
+    parser.add_argument('--filter-deadband', type=float, help='how much filtered temperature has to drop below a fan speed step before lowering the speed (C)', default=1)
+    parser.add_argument('--replay', type=str, help='replay recorded temperatures from this file, report filter effect and exit', default=None)
+    parser.add_argument('-q', '--profile', type=int, help='print per-iteration cost breakdown every this many main loop iterations (0 = disabled)', default=0)
+    parser.add_argument('--profile-dump', type=str, help='write cProfile stats of the first profiled iterations to this file', default=None)
+    parser.add_argument('-b', '--benchmark', type=int, help='benchmark curve evaluation for up to this many simulated devices and exit', default=0)
     parser.add_argument('-v', '--verbose', action='store_true', help='show verbose messages', default=False)
     parser.add_argument('-t', '--test', action='store_true', help='do not execute control commands', default=False)
 
@@ -185,12 +766,33 @@ def main():
     if args.verbose:
         print(args)
 
-    speed_curve, temp_points = parse_fan_curve(args.curve)
-    min_temp = temp_points[0]
+    settings = {
+        'curve': compile_fan_curve(args.curve),
+        'hysteresis': args.hysteresis,
+    }
+    curve, speed_curve, temp_points, min_temp, min_speed, speed_table = settings['curve']
     #max_temp = temp_points[len(temp_points) - 1]
-    min_speed = speed_curve[min_temp]
     #max_speed = max(speed_curve.values())
 
+    if args.benchmark > 0:
+        run_benchmark(args.benchmark, speed_curve, temp_points, min_temp, min_speed)
+        exit(0)
+
+    if args.replay:
+        run_replay(args.replay, args, settings)
+        exit(0)
+
+    control = {
+        'lock': threading.Lock(),
+        'base': settings,
+        'settings': settings,
+        'expires': None,
+        'changed': False,
+        'status': {},
+    }
+    server = None
+    profiler = None
+
     nvmlInit()
 
     try:
@@ -219,31 +821,73 @@ def main():
 
         #set_gpu_fan_policy(handle, fans, true)  # Not required as calling nvmlDeviceSetFanSpeed_v2 enforces manual mode
 
+        if args.socket:
+            server = create_control_socket(args.socket, create_control_handler(control, compile_settings))
+            print(f"Listening for control commands on {args.socket}")
+
         print(f"Running main loop (sleep = {args.sleep})...")
 
         state = {'running': True}
         control_temp = 0
+        band = None
+        deadband = 0
+        last_fan_speed = None
+        fan_speed = None
+        check_ticks = max(1, round(10 / args.sleep))  # Verify fan speed roughly every 10 seconds
+        ticks_since_check = check_ticks
+        hysteresis = settings['hysteresis']
+        sensor = None
+
+        if args.filter:
+            sensor = create_sensor_filter(args.filter, args.filter_size, args.filter_alpha, args.filter_slew, False)
+            deadband = args.filter_deadband
 
         signal.signal(signal.SIGINT, create_interrupt_handler(state))
         signal.signal(signal.SIGTERM, create_interrupt_handler(state))
 
+        if args.profile > 0:
+            profiler = create_profiler(args.profile, args.profile_dump)
+            wrap_profiled_calls(profiler)
+
         while state['running']:
+            if profiler:
+                profile_tick(profiler)
+
+            if server:
+                new_settings = poll_control_settings(control)
+                if new_settings:
+                    curve, speed_curve, temp_points, min_temp, min_speed, speed_table = new_settings['curve']
+                    hysteresis = new_settings['hysteresis']
+                    band = None
+
+                    if args.verbose:
+                        print(f"Applied settings: curve = {curve}, hysteresis = {hysteresis}")
+
             gpu_temp = nvmlDeviceGetTemperature(handle, NVML_TEMPERATURE_GPU)
-            fan_speed = nvmlDeviceGetFanSpeed(handle)
 
             #DEBUG
             #with open('debug-temp.txt', 'r') as file:
             #    gpu_temp = int(file.read().strip())
 
-            if args.hysteresis > 0 and gpu_temp > 50:  # Hysteresis at 50 and below doesn't make any sense
-                if gpu_temp > control_temp or gpu_temp <= control_temp - args.hysteresis:
-                    control_temp = gpu_temp
-            else:
-                control_temp = gpu_temp
-
-            target_fan_speed = interpolate_speed(control_temp, speed_curve, temp_points, min_temp, min_speed)
-
-            if fan_speed != target_fan_speed:
+            filtered_temp = gpu_temp
+            if sensor:
+                filtered_temp = round_half_up(apply_sensor_filter(sensor, gpu_temp))
+
+            control_temp = apply_hysteresis(filtered_temp, control_temp, hysteresis)
+            band = update_band(control_temp, band, speed_table, deadband)
+            target_fan_speed = band[0]
+
+            # Something else (driver after resume, other tools) could have changed fan control
+            ticks_since_check += 1
+            if ticks_since_check >= check_ticks:
+                ticks_since_check = 0
+                fan_speed = nvmlDeviceGetFanSpeed(handle)
+                if fan_speed != last_fan_speed:
+                    last_fan_speed = None
+
+            # Only write when filtered temperature leaves the band of the current fan speed
+            if last_fan_speed != target_fan_speed:
+                last_fan_speed = target_fan_speed
                 if not args.test:
                     set_gpu_fan_speed(handle, fans, target_fan_speed)
 
@@ -252,8 +896,33 @@ def main():
                 else:
                     print(f"Would set fan speed to {target_fan_speed}% ({gpu_temp}C)")
 
-            time.sleep(args.sleep)
+            if server:
+                control['status'] = {
+                    'temperature': gpu_temp,
+                    'filtered_temperature': filtered_temp,
+                    'control_temperature': control_temp,
+                    'fan_speed': fan_speed,  # As of the last fan speed check
+                    'target_fan_speed': target_fan_speed,
+                    'curve': curve,
+                    'hysteresis': hysteresis,
+                }
+
+            if profiler:
+                profile_sleep(profiler, args.sleep)
+            else:
+                time.sleep(args.sleep)
     finally:
+        if profiler:
+            try:
+                finish_profiler(profiler)
+            except Exception as error:  # Never let profiling prevent restoring GPU settings
+                builtins.print(f"Warning: Unable to finish profiling: {error}", file=sys.stderr)
+
+        if server:
+            server.close()
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+
         if not args.test:
             set_gpu_fan_policy(handle, fans or 1, False)
 
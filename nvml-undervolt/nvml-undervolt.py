@@ -17,6 +17,13 @@ import argparse
 import signal
 import math
 import platform
+import socket
+import stat
+import threading
+import json
+import random
+import builtins
+import cProfile
 
 try:
     from pynvml import *
@@ -83,6 +90,14 @@ def compare_versions(version1, version2):
 
     return True
 
+def import_numpy():
+    # Imported only when requested, it is not needed for the main loop and would only slow down startup
+    try:
+        import numpy
+        return numpy
+    except ModuleNotFoundError:
+        return None
+
 def create_interrupt_handler(variable):
     def interrupt_handler(sig, frame):
         variable['running'] = False
@@ -113,6 +128,70 @@ def validate_args(args):
         print("Error: Sleep time must be bigger than 0", file=sys.stderr)
         exit(1)
 
+    if args.profile < 0:
+        print("Error: Profile interval must not be negative", file=sys.stderr)
+        exit(1)
+
+    if args.profile_dump and not args.profile > 0:
+        print("Error: Profile dump requires profile interval to be set", file=sys.stderr)
+        exit(1)
+
+    try:
+        args.filter = parse_filters(args.filter)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not args.filter_size > 0:
+        print("Error: Filter size must be bigger than 0", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not 0 < args.filter_alpha <= 1:
+        print("Error: Filter alpha must be in range 0 - 1", file=sys.stderr)
+        exit(1)
+
+    if args.filter and not args.filter_slew > 0:
+        print("Error: Filter slew must be bigger than 0", file=sys.stderr)
+        exit(1)
+
+    if args.filter and args.filter_deadband < 0:
+        print("Error: Filter deadband must not be negative", file=sys.stderr)
+        exit(1)
+
+def compile_settings(values, current, step_mhz):
+    settings = dict(current)
+
+    for key, value in values.items():
+        if key in ['core_offset', 'target_clock', 'transition_clock']:
+            settings[key] = int(value)
+        elif key == 'curve_increment':
+            settings[key] = float(value)
+        else:
+            raise ValueError(f"Unknown setting '{key}'")
+
+    if not settings['core_offset'] > 0:
+        raise ValueError("Core offset must be bigger than 0")
+
+    if not settings['transition_clock'] > 0 or settings['transition_clock'] + 50 >= settings['target_clock']:
+        raise ValueError("Target clock must be bigger than transition clock by more than 50")
+
+    if settings['curve_increment'] < step_mhz * 2:
+        raise ValueError(f"Curve increment must not be lower than doubled clock step ({step_mhz*2})")
+
+    settings['offset_table'] = compile_offset_table(settings['core_offset'], settings['transition_clock'], settings['target_clock'], step_mhz)
+    return settings
+
+def validate_curve_increment(args, step_mhz):
+    if args.curve_increment == 0:
+        args.curve_increment = step_mhz * 2
+
+    if not args.curve_increment % step_mhz == 0:
+        print(f"Warning: Curve increment should be divisible by clock step ({step_mhz})", file=sys.stderr)
+
+    if args.curve_increment < step_mhz * 2:
+        print(f"Error: Curve increment must not be lower than doubled clock step ({step_mhz*2})", file=sys.stderr)
+        exit(1)
+
 def get_step_mhz(clocks):
     if len(clocks) <= 2:
         return 0
@@ -142,6 +221,415 @@ def interpolate_offset(value, offset, min_val, max_val, step_mhz):
         scaled_offset = int(scale * offset)
         return round_to_nearest_step(scaled_offset, step_mhz)
 
+def interpolate_offsets(values, offset, min_val, max_val, step_mhz, use_numpy = False):
+    # Same as interpolate_offset() but for many clocks (devices) at once
+    np = import_numpy() if use_numpy else None
+    if np is None:
+        return [interpolate_offset(value, offset, min_val, max_val, step_mhz) for value in values]
+
+    values = np.asarray(values, dtype=np.float64)
+    scaled_offset = np.trunc((values - min_val) / (max_val - min_val) * offset)
+    quotient = np.floor_divide(scaled_offset, step_mhz)
+    rounded = np.ceil(np.where(np.mod(scaled_offset, step_mhz) == 0, quotient, quotient + 1) * step_mhz)
+    rounded = np.where(scaled_offset == 0, 0, rounded)
+
+    offsets = np.where(values <= min_val, 0, np.where(values >= max_val, offset, rounded))
+    return offsets.astype(np.int64).tolist()
+
+def compile_bands(values, first):
+    # Group a lookup table into bands of equal values, so leaving a band is what counts as crossing a threshold
+    bands = [None] * len(values)
+    start = 0
+
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            low = first + start if start > 0 else -math.inf
+            high = first + i - 1 if i < len(values) else math.inf
+            band = (values[start], low, high)
+
+            for j in range(start, i):
+                bands[j] = band
+            start = i
+
+    return first, bands
+
+def lookup_band(value, table):
+    first, bands = table
+    index = value - first
+
+    if index < 0:
+        return bands[0]
+    if index >= len(bands):
+        return bands[-1]
+
+    return bands[index]
+
+def update_band(value, band, table, deadband_down = 0, deadband_up = 0):
+    # Keep the current band until the value leaves it by more than the deadband
+    if band is not None and band[1] - deadband_down <= value <= band[2] + deadband_up:
+        return band
+
+    return lookup_band(value, table)
+
+def compile_offset_table(core_offset, transition_clock, target_clock, step_mhz):
+    # Precompute offset for every clock between transition and target clock so the main loop only does a lookup
+    # Offsets are rounded up to the clock step so they have to be limited to the user defined offset
+    clocks = range(transition_clock, target_clock + 1)
+    offsets = interpolate_offsets(clocks, core_offset, transition_clock, target_clock, step_mhz)
+    return compile_bands([min(offset, core_offset) for offset in offsets], transition_clock)
+
+def step_clock_lock_window(min_clock, max_clock, clock, elapsed, args):
+    # Curve mode moves the clock lock window one increment at a time when the clock reaches its edges
+    if clock >= max_clock - 4 and elapsed > args.sleep:
+        if max_clock + args.curve_increment <= args.target_clock:
+            return min_clock + args.curve_increment, max_clock + args.curve_increment
+
+    elif clock <= min_clock + 4 and elapsed > args.sleep * 2:
+        if min_clock - args.curve_increment >= args.transition_clock:
+            return min_clock - args.curve_increment, max_clock - args.curve_increment
+
+    return min_clock, max_clock
+
+def step_clock_lock_windows(min_clocks, max_clocks, clocks, elapsed, args, use_numpy = False):
+    # Same as step_clock_lock_window() but for many devices at once
+    np = import_numpy() if use_numpy else None
+    if np is None:
+        return [step_clock_lock_window(min_clocks[i], max_clocks[i], clocks[i], elapsed[i], args) for i in range(len(clocks))]
+
+    min_clocks = np.asarray(min_clocks, dtype=np.float64)
+    max_clocks = np.asarray(max_clocks, dtype=np.float64)
+    clocks = np.asarray(clocks, dtype=np.float64)
+    elapsed = np.asarray(elapsed, dtype=np.float64)
+
+    up = (clocks >= max_clocks - 4) & (elapsed > args.sleep)
+    down = ~up & (clocks <= min_clocks + 4) & (elapsed > args.sleep * 2)
+    step = np.where(up & (max_clocks + args.curve_increment <= args.target_clock), args.curve_increment, 0)
+    step = np.where(down & (min_clocks - args.curve_increment >= args.transition_clock), -args.curve_increment, step)
+
+    return list(zip((min_clocks + step).tolist(), (max_clocks + step).tolist()))
+
+def parse_filters(value):
+    if not value or value.lower() == 'none':
+        return []
+
+    filters = [name.strip().lower() for name in value.split(',')]
+    for name in filters:
+        if name not in ['ema', 'median', 'slew']:
+            raise ValueError(f"Invalid filter '{name}', must be one of: ema, median, slew")
+
+    return filters
+
+def create_sensor_filter(filters, size, alpha, slew, limit_rise = True):
+    return {
+        'filters': filters,
+        'limit_rise': limit_rise,
+        'size': size,
+        'alpha': alpha,
+        'slew': slew,
+        'buffer': [0] * size,
+        'sorted': [0] * size,
+        'index': 0,
+        'count': 0,
+        'ema': None,
+        'value': None,
+    }
+
+def apply_sensor_filter(sensor, value):
+    for name in sensor['filters']:
+        if name == 'median':
+            buffer = sensor['buffer']
+            buffer[sensor['index']] = value
+            sensor['index'] = (sensor['index'] + 1) % sensor['size']
+
+            if sensor['count'] < sensor['size']:
+                sensor['count'] += 1
+                value = sorted(buffer[:sensor['count']])[sensor['count'] // 2]
+            else:
+                ordered = sensor['sorted']
+                ordered[:] = buffer
+                ordered.sort()
+                value = ordered[sensor['size'] // 2]
+
+        elif name == 'ema':
+            if sensor['ema'] is not None:
+                value = sensor['ema'] + sensor['alpha'] * (value - sensor['ema'])
+            sensor['ema'] = value
+
+        elif name == 'slew':
+            last = sensor['value']
+            if last is not None:
+                value = max(value, last - sensor['slew'])
+                if sensor['limit_rise']:
+                    value = min(value, last + sensor['slew'])
+            sensor['value'] = value
+
+    return value
+
+def round_half_up(value):
+    # round() rounds halves to even which would keep alternating readings alternating
+    return math.floor(value + 0.5)
+
+def read_replay(file_path):
+    values = []
+    skipped = 0
+
+    try:
+        with open(file_path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    try:
+                        values.append(int(float(line.split(',')[0])))
+                    except ValueError:  # Header or other non-numeric line
+                        skipped += 1
+    except OSError as error:
+        print(f"Error: Unable to read '{file_path}': {error}", file=sys.stderr)
+        exit(1)
+
+    if skipped > 0:
+        print(f"Warning: Skipped {skipped} non-numeric lines in '{file_path}'", file=sys.stderr)
+
+    return values
+
+def estimate_delay(reference, delayed, max_lag = 30):
+    best_lag = 0
+    best_error = None
+
+    for lag in range(min(max_lag, len(reference) - 1) + 1):
+        error = sum(abs(delayed[i] - reference[i - lag]) for i in range(lag, len(reference))) / (len(reference) - lag)
+        if best_error is None or error < best_error:
+            best_lag = lag
+            best_error = error
+
+    return best_lag
+
+def create_undervolt_state(args, now):
+    return {
+        'min_clock': args.transition_clock,
+        'max_clock': args.target_clock,
+        'offset': args.core_offset,
+        'band': None,
+        'last_clock': 0,
+        'last_offset': 0,
+        'last_change': now,
+        'last_underclock': False,
+        'underclock': False,
+        'updateclock': True,
+    }
+
+def update_undervolt_state(uv, args, pstate, clock, now, offset_table, deadband = 0):
+    if pstate <= args.pstates:
+        if not uv['last_underclock'] and clock >= args.transition_clock - 4 and now - uv['last_change'] > args.sleep:
+            uv['underclock'] = True
+
+            if args.curve:
+                uv['min_clock'] = args.transition_clock
+                uv['max_clock'] = args.transition_clock + args.curve_increment
+
+        elif uv['last_underclock'] and clock <= args.transition_clock + 4 and now - uv['last_change'] > args.sleep * 2:
+            uv['underclock'] = False
+
+        if args.curve:
+            if uv['underclock']:
+                min_clock, max_clock = step_clock_lock_window(uv['min_clock'], uv['max_clock'], clock, now - uv['last_change'], args)
+
+                if min_clock != uv['min_clock']:
+                    uv['min_clock'] = min_clock
+                    uv['max_clock'] = max_clock
+
+                    if uv['underclock'] == uv['last_underclock']:
+                        uv['updateclock'] = True
+
+            if uv['last_clock'] != clock:
+                uv['band'] = update_band(clock, uv['band'], offset_table, deadband, deadband)
+
+                # Only update when the clock leaves the band of the current offset
+                if uv['band'][0] != uv['offset']:
+                    uv['offset'] = uv['band'][0]
+                    uv['updateclock'] = True
+
+    else:
+        uv['underclock'] = False
+
+    return uv['underclock'] != uv['last_underclock'] or uv['updateclock']
+
+def limit_undervolt_state(uv, args):
+    if uv['max_clock'] > args.target_clock:
+        print(f"Attempted to set max clock to {uv['max_clock']} while user defined target clock is {args.target_clock}", file=sys.stderr)
+        uv['max_clock'] = args.target_clock
+
+    if uv['offset'] > args.core_offset:
+        print(f"Attempted to set offset to {uv['offset']} while user defined offset is {args.core_offset}", file=sys.stderr)
+        uv['offset'] = args.core_offset
+
+def run_replay(file_path, args, step_mhz):
+    clocks = read_replay(file_path)
+    if not clocks:
+        print(f"Error: No samples found in '{file_path}'", file=sys.stderr)
+        exit(1)
+
+    offset_table = compile_offset_table(args.core_offset, args.transition_clock, args.target_clock, step_mhz)
+    tick = args.sleep * 1.01  # Each iteration takes slightly longer than sleep time
+    results = []
+
+    for sensor in [None, create_sensor_filter(args.filter, args.filter_size, args.filter_alpha, args.filter_slew)]:
+        uv = create_undervolt_state(args, 0)
+        deadband = args.filter_deadband if sensor else 0
+        writes = 0
+        offset_changes = 0
+        control_clocks = []
+
+        for i, clock in enumerate(clocks):
+            if sensor:
+                clock = round_half_up(apply_sensor_filter(sensor, clock))
+
+            now = (i + 1) * tick
+            last_offset = uv['offset']
+            if update_undervolt_state(uv, args, args.pstates, clock, now, offset_table, deadband):
+                if uv['underclock']:
+                    limit_undervolt_state(uv, args)
+
+                writes += 1
+                if uv['offset'] != last_offset:
+                    offset_changes += 1
+
+                uv['updateclock'] = False
+                uv['last_change'] = now
+                uv['last_underclock'] = uv['underclock']
+
+            uv['last_clock'] = clock
+            uv['last_offset'] = uv['offset']
+            control_clocks.append(clock)
+
+        results.append((writes, offset_changes, control_clocks))
+
+    (raw_writes, raw_offsets, raw_clocks), (filtered_writes, filtered_offsets, filtered_clocks) = results
+    delay = estimate_delay(raw_clocks, filtered_clocks)
+    reduction = (1 - filtered_writes / raw_writes) * 100 if raw_writes > 0 else 0
+
+    print(f"Replayed {len(clocks)} samples (filter = {','.join(args.filter) or 'none'}, sleep = {args.sleep})")
+    print(f"Clock lock and offset updates: {raw_writes} unfiltered, {filtered_writes} filtered ({reduction:.1f}% fewer)")
+    print(f"  of which offset changes: {raw_offsets} unfiltered, {filtered_offsets} filtered")
+    print(f"Added reaction delay: {delay} ticks ({delay * args.sleep:.1f} s)")
+
+def create_profiler(interval, dump_path):
+    profiler = {
+        'interval': interval,
+        'dump_path': dump_path,
+        'cprofile': None,
+        'tick_start': None,
+        'ticks': 0,
+        'total': 0,
+        'phases': {},
+        'calls': {},
+    }
+
+    if dump_path:
+        profiler['cprofile'] = cProfile.Profile()
+
+    reset_profiler(profiler)
+    return profiler
+
+def reset_profiler(profiler):
+    profiler['ticks'] = 0
+    profiler['total'] = 0
+    profiler['phases'] = {'nvml_read': 0, 'nvml_write': 0, 'print': 0, 'sleep': 0, 'overshoot': 0}
+    profiler['calls'] = {}
+
+def create_profiled_call(profiler, name, function, phase):
+    def profiled_call(*arguments, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*arguments, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler['phases'][phase] += elapsed
+
+            call = profiler['calls'].get(name)
+            if call is None:
+                call = profiler['calls'][name] = [0, 0]
+            call[0] += 1
+            call[1] += elapsed
+
+    return profiled_call
+
+def wrap_profiled_calls(profiler):
+    module = globals()
+
+    for name, value in list(module.items()):
+        if name.startswith('nvml') and callable(value) and not isinstance(value, type):
+            phase = 'nvml_write' if 'Set' in name or 'Reset' in name else 'nvml_read'
+            module[name] = create_profiled_call(profiler, name, value, phase)
+
+    module['print'] = create_profiled_call(profiler, 'print', builtins.print, 'print')
+
+def profile_tick(profiler):
+    now = time.perf_counter()
+
+    if profiler['tick_start'] is None:  # First iteration, drop everything recorded during setup
+        reset_profiler(profiler)
+
+        if profiler['cprofile']:
+            profiler['cprofile'].enable()
+    else:
+        profiler['total'] += now - profiler['tick_start']
+        profiler['ticks'] += 1
+
+        if profiler['ticks'] >= profiler['interval']:
+            stop_profiler(profiler)
+            print_profile_summary(profiler)
+            reset_profiler(profiler)
+
+    profiler['tick_start'] = time.perf_counter()
+
+def profile_sleep(profiler, seconds):
+    start = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+
+    profiler['phases']['sleep'] += elapsed
+    profiler['phases']['overshoot'] += elapsed - seconds
+
+def stop_profiler(profiler):
+    cprofile = profiler['cprofile']
+    if not cprofile:
+        return
+
+    profiler['cprofile'] = None
+    cprofile.disable()
+
+    try:
+        cprofile.dump_stats(profiler['dump_path'])
+        builtins.print(f"Profile data written to {profiler['dump_path']} (view with: python3 -m pstats {profiler['dump_path']})")
+    except OSError as error:
+        builtins.print(f"Warning: Unable to write profile data to {profiler['dump_path']}: {error}", file=sys.stderr)
+
+def finish_profiler(profiler):
+    # Account the last iteration and report whatever was collected since the last summary
+    if profiler['tick_start'] is not None:
+        profiler['total'] += time.perf_counter() - profiler['tick_start']
+        profiler['ticks'] += 1
+        profiler['tick_start'] = None
+
+    stop_profiler(profiler)
+    print_profile_summary(profiler)
+
+def print_profile_summary(profiler):
+    ticks = profiler['ticks']
+    if ticks == 0:
+        return
+
+    phases = profiler['phases']
+    logic = profiler['total'] - phases['nvml_read'] - phases['nvml_write'] - phases['print'] - phases['sleep']
+
+    def ms(value):
+        return f"{value / ticks * 1000:.3f} ms"
+
+    builtins.print(f"Profile of {ticks} iterations (average per iteration): total = {ms(profiler['total'])}, nvml read = {ms(phases['nvml_read'])}, nvml write = {ms(phases['nvml_write'])}, logic = {ms(logic)}, print = {ms(phases['print'])}, sleep = {ms(phases['sleep'])} (overshoot = {ms(phases['overshoot'])})")
+
+    for name, (count, elapsed) in sorted(profiler['calls'].items(), key=lambda item: item[1][1], reverse=True):
+        builtins.print(f"  {name}: {count} calls, {elapsed / count * 1000000:.1f} us per call, {elapsed * 1000:.3f} ms total")
+
 def set_pstate_clocks(handle, clock_type, clock_offset, target_pstates):
     for pstate in range(0, target_pstates + 1):
         struct = c_nvmlClockOffset_t()
@@ -176,6 +664,179 @@ def set_clock_offset(handle, args, offset, pstates, type):
     if args.verbose:
         print(f"Setting {type} clock offset to {offset}")
 
+def parse_control_command(line):
+    parts = line.split()
+    if not parts:
+        raise ValueError("Empty command")
+
+    values = {}
+    for part in parts[1:]:
+        if '=' not in part:
+            raise ValueError(f"Invalid argument '{part}', expected 'key=value'")
+        key, value = part.split('=', 1)
+        values[key.lower().replace('-', '_')] = value
+
+    return parts[0].lower(), values
+
+def create_control_handler(control, compile_settings):
+    def control_handler(line):
+        command, values = parse_control_command(line)
+
+        if command == 'status':
+            status = dict(control['status'])
+            expires = control['expires']
+            status['override'] = max(0, round(expires - time.monotonic(), 1)) if expires is not None else None
+            return status
+
+        if command == 'set':
+            ttl = float(values.pop('ttl', 0))
+            if not math.isfinite(ttl) or ttl < 0:
+                raise ValueError("TTL must be a non-negative number")
+            if not values:
+                raise ValueError("Nothing to set")
+
+            with control['lock']:
+                if ttl > 0:
+                    control['settings'] = compile_settings(values, control['settings'])
+                    control['expires'] = time.monotonic() + ttl
+                else:
+                    control['base'] = compile_settings(values, control['base'])
+                    control['settings'] = compile_settings(values, control['settings'])
+                control['changed'] = True
+
+            return {'ok': True}
+
+        if command == 'reset':
+            with control['lock']:
+                control['settings'] = control['base']
+                control['expires'] = None
+                control['changed'] = True
+
+            return {'ok': True}
+
+        raise ValueError(f"Unknown command '{command}'")
+
+    return control_handler
+
+def create_control_socket(path, handler):
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Error: Control socket is not supported on this platform", file=sys.stderr)
+        exit(1)
+
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            print(f"Error: Control socket path '{path}' exists and is not a socket", file=sys.stderr)
+            exit(1)
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:  # Stale socket left behind by a previous run
+            os.unlink(path)
+        except OSError as error:
+            print(f"Error: Unable to check existing control socket '{path}': {error}", file=sys.stderr)
+            exit(1)
+        else:
+            print(f"Error: Another process is already listening on control socket '{path}'", file=sys.stderr)
+            exit(1)
+        finally:
+            probe.close()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # Socket must not be accessible by anyone else, not even briefly
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(4)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:  # Socket was closed
+                break
+
+            with connection:
+                try:
+                    connection.settimeout(1)
+                    line = connection.makefile('r').readline()
+                    response = handler(line.strip())
+                except Exception as error:
+                    response = {'error': str(error)}
+
+                try:
+                    connection.sendall((json.dumps(response) + '\n').encode())
+                except OSError:
+                    pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+def poll_control_settings(control):
+    if not control['changed'] and control['expires'] is None:
+        return None
+
+    with control['lock']:
+        if control['expires'] is not None and time.monotonic() >= control['expires']:
+            control['settings'] = control['base']
+            control['expires'] = None
+            control['changed'] = True
+
+        if not control['changed']:
+            return None
+
+        control['changed'] = False
+        return control['settings']
+
+def run_benchmark(max_devices, args, step_mhz, iterations = 200):
+    def evaluate(devices, use_numpy):
+        clocks, min_clocks, max_clocks, elapsed = devices
+        offsets = interpolate_offsets(clocks, args.core_offset, args.transition_clock, args.target_clock, step_mhz, use_numpy)
+        windows = step_clock_lock_windows(min_clocks, max_clocks, clocks, elapsed, args, use_numpy)
+        return offsets, windows
+
+    def evaluate_loop(devices):
+        clocks, min_clocks, max_clocks, elapsed = devices
+        offsets = [interpolate_offset(clock, args.core_offset, args.transition_clock, args.target_clock, step_mhz) for clock in clocks]
+        windows = [step_clock_lock_window(min_clocks[i], max_clocks[i], clocks[i], elapsed[i], args) for i in range(len(clocks))]
+        return offsets, windows
+
+    methods = [('loop', evaluate_loop), ('batch', lambda devices: evaluate(devices, False))]
+    if import_numpy() is not None:
+        methods.append(('numpy', lambda devices: evaluate(devices, True)))
+    else:
+        print("Warning: Module 'numpy' not found, skipping numpy benchmark", file=sys.stderr)
+
+    print(f"{'devices':>8}" + ''.join(f"{name + ' (us)':>14}" for name, _ in methods))
+
+    windows = max(1, int((args.target_clock - args.transition_clock) // args.curve_increment))
+
+    devices = 1
+    while devices <= max_devices:
+        # Each simulated device has its own clock, current clock lock window and time since the last change
+        min_clocks = [args.transition_clock + random.randrange(windows) * args.curve_increment for _ in range(devices)]
+        max_clocks = [min_clock + args.curve_increment for min_clock in min_clocks]
+        clocks = [random.randint(args.transition_clock - 100, args.target_clock + 100) for _ in range(devices)]
+        elapsed = [random.uniform(0, args.sleep * 3) for _ in range(devices)]
+        simulated = (clocks, min_clocks, max_clocks, elapsed)
+
+        expected = methods[0][1](simulated)
+        row = f"{devices:>8}"
+
+        for name, method in methods:
+            if method(simulated) != expected:
+                print(f"Error: '{name}' results differ from reference", file=sys.stderr)
+                exit(1)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                method(simulated)
+            row += f"{(time.perf_counter() - start) / iterations * 1000000:>14.1f}"
+
+        print(row)
+        devices *= 2
+
 def main():
     parser = argparse.ArgumentParser(
         description="Undervolt script using official NVML API",
@@ -197,6 +858,16 @@ def main():
     parser.add_argument('-d', '--temperature-limit', type=int, help='temperature limit in celsius (C)', default=0)
     parser.add_argument('-p', '--pstates', type=int, help='pstates to apply to', default=0)
     parser.add_argument('-s', '--sleep', type=float, help='sleep time in main loop', default=0.5)
+    parser.add_argument('-o', '--socket', type=str, help='control socket path', default=None)
+    parser.add_argument('-f', '--filter', type=str, help='core clock filters to apply, in order (ema, median, slew)', default=None)
+    parser.add_argument('--filter-size', type=int, help='median filter window size', default=5)
+    parser.add_argument('--filter-alpha', type=float, help='EMA filter smoothing factor', default=0.5)
+    parser.add_argument('--filter-slew', type=float, help='slew filter maximum change per loop iteration (MHz)', default=30)
+    parser.add_argument('--filter-deadband', type=float, help='how far filtered clock has to move past an offset step before changing the offset (MHz)', default=15)
+    parser.add_argument('--replay', type=str, help='replay recorded core clocks from this file, report filter effect and exit', default=None)
+    parser.add_argument('-q', '--profile', type=int, help='print per-iteration cost breakdown every this many main loop iterations (0 = disabled)', default=0)
+    parser.add_argument('--profile-dump', type=str, help='write cProfile stats of the first profiled iterations to this file', default=None)
+    parser.add_argument('-b', '--benchmark', type=int, help='benchmark offset evaluation for up to this many simulated devices and exit', default=0)
     parser.add_argument('-v', '--verbose', action='store_true', help='show verbose messages', default=False)
     parser.add_argument('-t', '--test', action='store_true', help='do not execute control commands', default=False)
 
@@ -212,6 +883,24 @@ def main():
     if args.verbose:
         print(args)
 
+    if args.benchmark > 0 or args.replay:
+        # There is no device to detect clock step from
+        step_mhz = args.clock_step
+        if not step_mhz > 0:
+            print("Warning: Clock step is not set, using fallback value of 15", file=sys.stderr)
+            step_mhz = 15
+
+        validate_curve_increment(args, step_mhz)
+
+        if args.replay:
+            run_replay(args.replay, args, step_mhz)
+        else:
+            run_benchmark(args.benchmark, args, step_mhz)
+        exit(0)
+
+    server = None
+    profiler = None
+
     nvmlInit()
 
     try:
@@ -258,15 +947,7 @@ def main():
             if args.verbose:
                 print(f"Using user defined clock step of {step_mhz} MHz")
 
-        if args.curve_increment == 0:
-            args.curve_increment = step_mhz * 2
-
-        if not args.curve_increment % step_mhz == 0:
-            print(f"Warning: Curve increment should be divisible by clock step ({step_mhz})", file=sys.stderr)
-
-        if args.curve_increment < step_mhz * 2:
-            print(f"Error: Curve increment must not be lower than doubled clock step ({step_mhz*2})", file=sys.stderr)
-            exit(1)
+        validate_curve_increment(args, step_mhz)
 
         if platform.system() == 'Linux':
             try:
@@ -326,6 +1007,26 @@ def main():
             else:
                 raise error
 
+        settings = {
+            'core_offset': args.core_offset,
+            'target_clock': args.target_clock,
+            'transition_clock': args.transition_clock,
+            'curve_increment': args.curve_increment,
+            'offset_table': compile_offset_table(args.core_offset, args.transition_clock, args.target_clock, step_mhz),
+        }
+        control = {
+            'lock': threading.Lock(),
+            'base': settings,
+            'settings': settings,
+            'expires': None,
+            'changed': False,
+            'status': {},
+        }
+
+        if args.socket:
+            server = create_control_socket(args.socket, create_control_handler(control, lambda values, current: compile_settings(values, current, step_mhz)))
+            print(f"Listening for control commands on {args.socket}")
+
         print(f"Running main loop (sleep = {args.sleep})...")
 
         state = {'running': True}
@@ -333,18 +1034,52 @@ def main():
         signal.signal(signal.SIGINT, create_interrupt_handler(state))
         signal.signal(signal.SIGTERM, create_interrupt_handler(state))
 
-        min_clock = args.transition_clock
-        max_clock = args.target_clock
-        offset = args.core_offset
+        if args.profile > 0:
+            profiler = create_profiler(args.profile, args.profile_dump)
+            wrap_profiled_calls(profiler)
 
-        last_clock = 0
-        last_offset = 0
-        last_change = time.time()
-        last_underclock = False
-        underclock = False
-        updateclock = True
+        uv = create_undervolt_state(args, time.time())
+        offset_table = settings['offset_table']
+        sensor = None
+        deadband = 0
+
+        if args.filter:
+            sensor = create_sensor_filter(args.filter, args.filter_size, args.filter_alpha, args.filter_slew)
+            deadband = args.filter_deadband
 
         while state['running']:
+            if profiler:
+                profile_tick(profiler)
+
+            if server:
+                new_settings = poll_control_settings(control)
+                if new_settings:
+                    transition_clock = args.transition_clock
+                    for key, value in new_settings.items():
+                        if key == 'offset_table':
+                            offset_table = value
+                        else:
+                            setattr(args, key, value)
+
+                    if args.curve:
+                        # Keep the current clock lock window, just fit it into the new range
+                        uv['min_clock'] = max(args.transition_clock, min(uv['min_clock'], args.target_clock - args.curve_increment))
+                        uv['max_clock'] = uv['min_clock'] + args.curve_increment
+                        uv['band'] = lookup_band(uv['last_clock'], offset_table)
+                        uv['offset'] = uv['band'][0]
+                    else:
+                        uv['min_clock'] = args.transition_clock
+                        uv['max_clock'] = args.target_clock
+                        uv['offset'] = args.core_offset
+
+                    # While disabled only the clock lock below transition clock is set, so skip the write unless that moved
+                    if uv['underclock'] or args.transition_clock != transition_clock:
+                        uv['updateclock'] = True
+
+                    if args.verbose:
+                        applied = {key: value for key, value in new_settings.items() if key != 'offset_table'}
+                        print(f"Applied settings: {applied}")
+
             pstate = nvmlDeviceGetPerformanceState(handle)
             clock = nvmlDeviceGetClockInfo(handle, NVML_CLOCK_GRAPHICS)
 
@@ -354,43 +1089,15 @@ def main():
             #with open('debug-clock.txt', 'r') as file:
             #    clock = int(file.read().strip())
 
-            if pstate <= args.pstates:
-                if not last_underclock and clock >= args.transition_clock - 4 and time.time() - last_change > args.sleep:
-                    underclock = True
-
-                    if args.curve:
-                        min_clock = args.transition_clock
-                        max_clock = args.transition_clock + args.curve_increment
-
-                elif last_underclock and clock <= args.transition_clock + 4 and time.time() - last_change > args.sleep * 2:
-                    underclock = False
-
-                if args.curve:
-                    if underclock:
-                        if clock >= max_clock - 4 and time.time() - last_change > args.sleep:
-                            if max_clock + args.curve_increment <= args.target_clock:
-                                min_clock = min_clock + args.curve_increment
-                                max_clock = max_clock + args.curve_increment
-
-                                if underclock == last_underclock:
-                                    updateclock = True
-
-                        elif clock <= min_clock + 4 and time.time() - last_change > args.sleep * 2:
-                            if min_clock - args.curve_increment >= args.transition_clock:
-                                min_clock = min_clock - args.curve_increment
-                                max_clock = max_clock - args.curve_increment
+            filtered_clock = clock
+            if sensor:
+                filtered_clock = round_half_up(apply_sensor_filter(sensor, clock))
 
-                                if underclock == last_underclock:
-                                    updateclock = True
+            if update_undervolt_state(uv, args, pstate, filtered_clock, time.time(), offset_table, deadband):
+                underclock = uv['underclock']
+                updateclock = uv['updateclock']
+                last_offset = uv['last_offset']
 
-                    if last_clock != clock:
-                        offset = interpolate_offset(clock, args.core_offset, args.transition_clock, args.target_clock, step_mhz)
-                        updateclock = True
-
-            else:
-                underclock = False
-
-            if underclock != last_underclock or updateclock:
                 if underclock:
                     if args.verbose:
                         if not updateclock:
@@ -398,13 +1105,10 @@ def main():
                         else:
                             print(f"Updating clock lock and offset at P{pstate} {clock}")
 
-                    if max_clock > args.target_clock:
-                        print(f"Attempted to set max clock to {max_clock} while user defined target clock is {args.target_clock}", file=sys.stderr)
-                        max_clock = args.target_clock
-
-                    if offset > args.core_offset:
-                        print(f"Attempted to set offset to {offset} while user defined offset is {args.core_offset}", file=sys.stderr)
-                        offset = args.core_offset
+                    limit_undervolt_state(uv, args)
+                    min_clock = uv['min_clock']
+                    max_clock = uv['max_clock']
+                    offset = uv['offset']
 
                     # Set clock lock before setting offset when going up
                     if offset >= last_offset and args.transition_clock > 0 and args.target_clock > 0:
@@ -433,15 +1137,41 @@ def main():
                     if args.transition_clock > 0 and args.target_clock > 0:
                         set_clock_lock(handle, args, 0, args.transition_clock)
 
-                updateclock = False
-                last_change = time.time()
-                last_underclock = underclock
+                uv['updateclock'] = False
+                uv['last_change'] = time.time()
+                uv['last_underclock'] = underclock
+
+            uv['last_clock'] = filtered_clock
+            uv['last_offset'] = uv['offset']
+
+            if server:
+                control['status'] = {
+                    'pstate': pstate,
+                    'clock': clock,
+                    'filtered_clock': filtered_clock,
+                    'undervolt': uv['underclock'],
+                    'min_clock': uv['min_clock'],
+                    'max_clock': uv['max_clock'],
+                    'offset': uv['offset'],
+                    'settings': {key: getattr(args, key) for key in settings if key != 'offset_table'},
+                }
+
+            if profiler:
+                profile_sleep(profiler, args.sleep)
+            else:
+                time.sleep(args.sleep)
+    finally:
+        if profiler:
+            try:
+                finish_profiler(profiler)
+            except Exception as error:  # Never let profiling prevent restoring GPU settings
+                builtins.print(f"Warning: Unable to finish profiling: {error}", file=sys.stderr)
 
-            last_clock = clock
-            last_offset = offset
+        if server:
+            server.close()
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
 
-            time.sleep(args.sleep)
-    finally:
         if not args.test:
             nvmlDeviceSetPowerManagementLimit(handle, nvmlDeviceGetPowerManagementDefaultLimit(handle))
 